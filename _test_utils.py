@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+测试脚本公共工具
+各 test_*.py 共用的会话、并发请求、JSON 编解码和连接检查
+"""
+
+import requests
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 并发请求的最大线程数
+MAX_WORKERS = 8
+
+# 限流（429）和网关错误（502/504）在连接池内自动重试，重试次数用完后返回最后一次的响应
+# 服务器自身的 500/503 不重试：它已经带密钥轮换重试过上游，503 则是配置错误
+# 读取超时不重试：请求已到达服务器，重发只会重复消耗 token
+_RETRY = Retry(
+    total=3,
+    read=0,
+    backoff_factor=0.3,
+    status_forcelist=(429, 502, 504),
+    allowed_methods=frozenset(["HEAD", "GET", "POST"]),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时回退到标准库 json
+    orjson = None
+
+def loads_json(raw):
+    """解析 JSON，安装了 orjson 时使用其 C 实现（解析错误同样是 json.JSONDecodeError）"""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def dumps_json(obj) -> bytes:
+    """序列化为 UTF-8 JSON 请求体，安装了 orjson 时使用其 C 实现"""
+    return orjson.dumps(obj) if orjson else json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+class ChatResult(NamedTuple):
+    """聊天补全响应中测试用到的字段"""
+    content: str
+    completion_tokens: int
+    total_tokens: int
+
+def parse_chat_response(body) -> ChatResult:
+    """解析 /v1/chat/completions 的响应体，缺失的字段取空值"""
+    data = loads_json(body)
+    choices = data.get("choices") or [{}]
+    usage = data.get("usage") or {}
+    return ChatResult(
+        content=choices[0].get("message", {}).get("content") or "",
+        completion_tokens=usage.get("completion_tokens", 0),
+        total_tokens=usage.get("total_tokens", 0)
+    )
+
+# 本进程内已经探测成功的服务器地址
+_reachable_servers = set()
+
+def check_server(session: requests.Session, base_url: str) -> bool:
+    """用共享 Session 发送 HEAD 检查服务器是否可以连接，同一进程内每个地址只需探测成功一次"""
+    if base_url in _reachable_servers:
+        return True
+    try:
+        session.head(base_url, timeout=2, allow_redirects=False).close()
+    except requests.RequestException:
+        return False
+    _reachable_servers.add(base_url)
+    return True
+
+def create_session(api_key: str) -> requests.Session:
+    """创建共享 Session：公共请求头只设置一次，连接池大小与并发线程数一致，临时错误自动重试"""
+    session = requests.Session()
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    })
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=_RETRY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def post_chat(session: requests.Session, base_url: str, payload: dict):
+    """发送单个聊天请求，异常作为结果返回，便于并发完成后按顺序输出
+
+    成功的响应体在工作线程内读完，连接随即归还连接池；
+    非 200 响应保留未读的流，由 read_error_text 只读取前一部分
+    """
+    try:
+        response = session.post(
+            f"{base_url}/v1/chat/completions",
+            data=dumps_json(payload),
+            timeout=30,
+            stream=True
+        )
+        if response.status_code == 200:
+            response.content
+        return response
+    except Exception as e:
+        return e
+
+def post_all(session: requests.Session, base_url: str, payloads: list) -> list:
+    """并发发送相互独立的请求（最多 MAX_WORKERS 个同时进行），结果顺序与 payloads 一致，全部完成后由调用方按顺序输出"""
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(payloads))) as executor:
+        return list(executor.map(lambda payload: post_chat(session, base_url, payload), payloads))
+
+def report_cases(cases, responses):
+    """按顺序产出 (序号, 用例, 响应, 输出缓冲)，每个用例处理完后把缓冲一次性写到 stdout"""
+    for i, (case, response) in enumerate(zip(cases, responses), 1):
+        buf = io.StringIO()
+        yield i, case, response, buf
+        sys.stdout.write(buf.getvalue())
+
+def json_intent(response: requests.Response, fallback: bool) -> bool:
+    """读取 X-JSON-Intent 响应头；旧版服务器没有该响应头时沿用 token 启发式结果"""
+    header = response.headers.get("X-JSON-Intent")
+    return header == "1" if header is not None else fallback
+
+def preview(text: str, limit: int = 100) -> str:
+    """截取前 limit 个字符作为预览，被截断时追加省略号"""
+    return text[:limit] + ("..." if len(text) > limit else "")
+
+def read_error_text(response: requests.Response, limit: int = 512) -> str:
+    """只读取错误响应体的前 limit 字节（请求需以 stream=True 发送），避免完整下载大的错误页面"""
+    raw = response.raw.read(limit, decode_content=True)
+    response.close()
+    return raw.decode("utf-8", "replace")
@@ -2,7 +2,7 @@ import { OpenAIRequest } from "./types/openai.ts";
 import { configManager, logger } from "./config/env.ts";
 import { modelService } from "./services/modelService.ts";
 import { geminiClient } from "./services/geminiClient.ts";
-import { transformOpenAIRequestToGemini } from "./transformers/openaiToGemini.ts";
+import { transformOpenAIRequestToGemini, detectJsonRequest } from "./transformers/openaiToGemini.ts";
 import { transformGeminiResponseToOpenAI, transformGeminiErrorToOpenAI } from "./transformers/geminiToOpenAI.ts";
 import { createGeminiToOpenAISSEStream } from "./transformers/streamTransformer.ts";
 import { authenticateRequest, createAuthErrorResponse } from "./middleware/auth.ts";
@@ -340,9 +340,14 @@ async function handleChatCompletions(req: Request): Promise<Response> {
 
     // 将OpenAI请求转换为Gemini格式
     logger.info(`[${requestId}] 🔄 开始转换请求格式 (OpenAI -> Gemini)`);
-    const geminiRequest = transformOpenAIRequestToGemini(openaiRequest, openaiRequest.model);
+    // 智能检测JSON请求（只检测一次，转换和响应头共用结果）
+    const isJsonRequest = detectJsonRequest(openaiRequest);
+    const geminiRequest = transformOpenAIRequestToGemini(openaiRequest, openaiRequest.model, isJsonRequest);
     logger.info(`[${requestId}] ✅ 请求格式转换完成`);
 
+    // 通过响应头告知客户端是否按 JSON 请求处理
+    const jsonIntentHeader = { "X-JSON-Intent": isJsonRequest ? "1" : "0" };
+
     if (openaiRequest.stream) {
       // 处理流式响应
       logger.info(`[${requestId}] 🌊 开始流式请求到Gemini API`);
@@ -356,6 +361,7 @@ async function handleChatCompletions(req: Request): Promise<Response> {
           "Content-Type": "text/event-stream",
           "Cache-Control": "no-cache",
           "Connection": "keep-alive",
+          ...jsonIntentHeader,
           ...getCorsHeaders(),
         },
       });
@@ -397,6 +403,7 @@ async function handleChatCompletions(req: Request): Promise<Response> {
         status: 200,
         headers: {
           "Content-Type": "application/json",
+          ...jsonIntentHeader,
           ...getCorsHeaders()
         },
       });
@@ -437,6 +444,7 @@ function getCorsHeaders(): Record<string, string> {
     "Access-Control-Allow-Origin": config.corsOrigin,
     "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
     "Access-Control-Allow-Headers": "Content-Type, Authorization, x-api-key",
+    "Access-Control-Expose-Headers": "X-JSON-Intent",
     "Access-Control-Max-Age": "86400",
   };
 }
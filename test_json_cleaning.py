@@ -6,151 +6,203 @@ JSON 清理功能测试
 
 import requests
 import json
+import re
 import sys
+from _test_utils import check_server, create_session, dumps_json, loads_json, parse_chat_response, post_all, read_error_text, report_cases
 
-def test_json_cleaning(api_key: str, base_url: str):
-    """测试 JSON 清理功能"""
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+# JSON 格式问题标志位
+QUOTE_WRAPPED = 1 << 0      # 整体被引号包围
+LEAD_COMMA = 1 << 1         # 对象开头多余逗号，如 {,
+TAIL_COMMA = 1 << 2         # 对象结尾多余逗号，如 ,}
+UNBALANCED_BRACES = 1 << 3  # 大括号数量不匹配
+
+def scan_json_issues(content: str) -> int:
+    """检查常见的 JSON 格式问题，返回问题标志位的组合"""
+    stripped = content.strip()
+    issues = 0
+    if stripped.startswith('"') and stripped.endswith('"'):
+        issues |= QUOTE_WRAPPED
+    if '{,' in content:
+        issues |= LEAD_COMMA
+    if ',}' in content:
+        issues |= TAIL_COMMA
+    if content.count('{') != content.count('}'):
+        issues |= UNBALANCED_BRACES
+    return issues
+
+# 参考清理实现使用的正则（与服务器 cleanJsonResponse 保持一致，\w 仅匹配 ASCII）
+_LEAD_COMMA_RE = re.compile(r'^\{\s*,')
+_TAIL_COMMA_RE = re.compile(r',\s*\}\Z')
+_UNQUOTED_KEY_RE = re.compile(r'(\w+):', re.ASCII)
+_UNQUOTED_VALUE_RE = re.compile(r':\s*([^",{}\[\]]+)(?=\s*[,}])')
+_LITERAL_RE = re.compile(r'true|false|null|\d+(\.\d+)?', re.ASCII)
+
+def _quote_value(match: re.Match) -> str:
+    value = match.group(1).strip()
+    # 数字、布尔值和 null 不加引号
+    if _LITERAL_RE.fullmatch(value):
+        return f": {value}"
+    return f": \"{value}\""
+
+def clean_json_text(content: str) -> str:
+    """服务器 cleanJsonResponse 的参考实现，清理失败时返回原始内容"""
+    trimmed = content.strip()
+    if '{' not in trimmed or '}' not in trimmed:
+        return content
     
-    print("🧹 JSON 清理功能测试")
-    print("验证 JSON 格式清理和修复功能")
-    print("=" * 60)
+    cleaned = trimmed
+    if cleaned.startswith('"') and cleaned.endswith('"'):
+        cleaned = cleaned[1:-1]
+    cleaned = _LEAD_COMMA_RE.sub('{', cleaned)
+    cleaned = _TAIL_COMMA_RE.sub('}', cleaned)
+    cleaned = _UNQUOTED_KEY_RE.sub(r'"\1":', cleaned)
+    cleaned = _UNQUOTED_VALUE_RE.sub(_quote_value, cleaned)
     
-    # 模拟可能产生错误 JSON 的请求
-    test_cases = [
-        {
-            "name": "情感分析 JSON 请求",
-            "payload": {
-                "model": "gemini-2.5-flash-preview-05-20",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": """
+    try:
+        loads_json(cleaned)
+    except json.JSONDecodeError:
+        return content
+    return cleaned
+
+# 模拟可能产生错误 JSON 的请求
+_TEST_CASES = (
+    {
+        "name": "情感分析 JSON 请求",
+        "payload": {
+            "model": "gemini-2.5-flash-preview-05-20",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": """
 请分析以下对话的情感，返回JSON格式：
 对话：「你好，今天天气真好！」
 请返回格式：{"emotion": "情感", "confidence": 0.9}
                         """
-                    }
-                ],
-                "max_tokens": 100
-            }
-        },
-        {
-            "name": "立场分析 JSON 请求",
-            "payload": {
-                "model": "gemini-2.5-flash-preview-05-20",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": """
+                }
+            ],
+            "max_tokens": 100
+        }
+    },
+    {
+        "name": "立场分析 JSON 请求",
+        "payload": {
+            "model": "gemini-2.5-flash-preview-05-20",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": """
 请分析立场，返回JSON格式：
 被回复：「这个想法不错」
 回复：「我也这么认为」
 请返回：{"立场": "支持", "情绪": "开心"}
                         """
-                    }
-                ],
-                "max_tokens": 200
-            }
-        },
-        {
-            "name": "用户信息 JSON 请求",
-            "payload": {
-                "model": "gemini-1.5-flash",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": "请用JSON格式返回一个用户信息示例，包含姓名、年龄、城市"
-                    }
-                ],
-                "max_tokens": 150
-            }
+                }
+            ],
+            "max_tokens": 200
         }
-    ]
+    },
+    {
+        "name": "用户信息 JSON 请求",
+        "payload": {
+            "model": "gemini-1.5-flash",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": "请用JSON格式返回一个用户信息示例，包含姓名、年龄、城市"
+                }
+            ],
+            "max_tokens": 150
+        }
+    }
+)
+
+def test_json_cleaning(session: requests.Session, base_url: str):
+    """测试 JSON 清理功能"""
+    
+    print("🧹 JSON 清理功能测试")
+    print("验证 JSON 格式清理和修复功能")
+    print("=" * 60)
     
     success_count = 0
     
-    for i, test_case in enumerate(test_cases, 1):
-        print(f"\n📋 测试 {i}: {test_case['name']}")
-        print("-" * 40)
+    responses = post_all(session, base_url, [test_case["payload"] for test_case in _TEST_CASES])
+    
+    for i, test_case, response, buf in report_cases(_TEST_CASES, responses):
+        print(f"\n📋 测试 {i}: {test_case['name']}", file=buf)
+        print("-" * 40, file=buf)
         
         try:
-            response = requests.post(
-                f"{base_url}/v1/chat/completions",
-                headers=headers,
-                json=test_case["payload"],
-                timeout=30
-            )
+            if isinstance(response, Exception):
+                raise response
             
-            print(f"📡 响应状态: {response.status_code}")
+            print(f"📡 响应状态: {response.status_code}", file=buf)
             
             if response.status_code == 200:
-                data = response.json()
-                content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-                usage = data.get('usage', {})
+                result = parse_chat_response(response.content)
+                content = result.content
+                completion_tokens = result.completion_tokens
                 
-                completion_tokens = usage.get('completion_tokens', 0)
-                
-                print(f"✅ 请求成功")
-                print(f"📊 输出 tokens: {completion_tokens}")
-                print(f"📝 原始回复: \"{content}\"")
+                print(f"✅ 请求成功", file=buf)
+                print(f"📊 输出 tokens: {completion_tokens}", file=buf)
+                print(f"📝 原始回复: \"{content}\"", file=buf)
                 
                 # 验证 JSON 格式
                 try:
-                    parsed = json.loads(content)
-                    print(f"✅ JSON 解析成功")
-                    print(f"🎯 解析结果: {json.dumps(parsed, ensure_ascii=False, indent=2)}")
+                    parsed = loads_json(content)
+                    print(f"✅ JSON 解析成功", file=buf)
+                    print(f"🎯 解析结果: {json.dumps(parsed, ensure_ascii=False, indent=2)}", file=buf)
                     success_count += 1
                     
                     # 检查是否有常见的格式问题被修复
-                    if content.strip().startswith('"') and content.strip().endswith('"'):
-                        print(f"⚠️ 检测到可能的引号包围问题（已修复）")
+                    if scan_json_issues(content) & QUOTE_WRAPPED:
+                        print(f"⚠️ 检测到可能的引号包围问题（已修复）", file=buf)
+                    
+                    # 服务器清理结果应与参考实现一致（再次清理不改变解析结果）
+                    if loads_json(clean_json_text(content)) != parsed:
+                        print(f"⚠️ 与参考清理实现的结果不一致", file=buf)
                     
                 except json.JSONDecodeError as e:
-                    print(f"❌ JSON 解析失败: {e}")
-                    print(f"📝 问题内容: \"{content}\"")
+                    print(f"❌ JSON 解析失败: {e}", file=buf)
+                    print(f"📝 问题内容: \"{content}\"", file=buf)
                     
                     # 分析具体的格式问题
-                    if content.strip().startswith('"') and content.strip().endswith('"'):
-                        print(f"🔍 检测到引号包围问题")
-                    if ',}' in content:
-                        print(f"🔍 检测到多余逗号问题")
-                    if content.startswith('{,'):
-                        print(f"🔍 检测到开头逗号问题")
+                    issues = scan_json_issues(content)
+                    if issues & QUOTE_WRAPPED:
+                        print(f"🔍 检测到引号包围问题", file=buf)
+                    if issues & TAIL_COMMA:
+                        print(f"🔍 检测到多余逗号问题", file=buf)
+                    if issues & LEAD_COMMA:
+                        print(f"🔍 检测到开头逗号问题", file=buf)
+                    
+                    # 参考实现能修复说明服务器清理没有生效
+                    if clean_json_text(content) != content:
+                        print(f"🔍 参考清理实现可以修复该内容，服务器清理未生效", file=buf)
                     
             else:
-                print(f"❌ 请求失败: {response.status_code}")
+                print(f"❌ 请求失败: {response.status_code}", file=buf)
+                error_text = read_error_text(response)
                 try:
-                    error_data = response.json()
-                    print(f"   错误信息: {error_data}")
+                    error_data = loads_json(error_text)
+                    print(f"   错误信息: {error_data}", file=buf)
                 except:
-                    print(f"   错误文本: {response.text[:200]}")
+                    print(f"   错误文本: {error_text[:200]}", file=buf)
                     
         except Exception as e:
-            print(f"❌ 请求异常: {e}")
+            print(f"❌ 请求异常: {e}", file=buf)
     
     print(f"\n🎯 JSON 清理测试结果:")
-    print(f"✅ 成功解析: {success_count}/{len(test_cases)} ({success_count/len(test_cases)*100:.1f}%)")
+    print(f"✅ 成功解析: {success_count}/{len(_TEST_CASES)} ({success_count/len(_TEST_CASES)*100:.1f}%)")
     
-    if success_count == len(test_cases):
+    if success_count == len(_TEST_CASES):
         print(f"🎉 完美！JSON 清理功能完全正常")
-    elif success_count >= len(test_cases) * 0.8:
+    elif success_count >= len(_TEST_CASES) * 0.8:
         print(f"👍 很好！JSON 清理基本正常")
     else:
         print(f"⚠️ JSON 清理需要进一步优化")
 
-def test_problematic_json_cases(api_key: str, base_url: str):
+def test_problematic_json_cases(session: requests.Session, base_url: str):
     """测试特定的问题 JSON 案例"""
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
     print(f"\n🔧 问题 JSON 案例测试")
     print("=" * 40)
     
@@ -186,23 +238,21 @@ def test_problematic_json_cases(api_key: str, base_url: str):
     print(f"📤 发送问题案例测试请求...")
     
     try:
-        response = requests.post(
+        response = session.post(
             f"{base_url}/v1/chat/completions",
-            headers=headers,
-            json=problematic_case,
+            data=dumps_json(problematic_case),
             timeout=30
         )
         
         print(f"📡 响应状态: {response.status_code}")
         
         if response.status_code == 200:
-            data = response.json()
-            content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
+            content = parse_chat_response(response.content).content
             
             print(f"📝 原始回复: \"{content}\"")
             
             try:
-                parsed = json.loads(content)
+                parsed = loads_json(content)
                 print(f"✅ JSON 解析成功")
                 print(f"🎯 立场: {parsed.get('立场', 'N/A')}")
                 print(f"🎯 情绪: {parsed.get('情绪', 'N/A')}")
@@ -218,13 +268,14 @@ def test_problematic_json_cases(api_key: str, base_url: str):
                 
                 # 详细分析问题
                 print(f"🔍 问题分析:")
-                if content.strip().startswith('"') and content.strip().endswith('"'):
+                issues = scan_json_issues(content)
+                if issues & QUOTE_WRAPPED:
                     print(f"   - 检测到整体引号包围问题")
-                if '{,' in content:
+                if issues & LEAD_COMMA:
                     print(f"   - 检测到开头逗号问题")
-                if ',}' in content:
+                if issues & TAIL_COMMA:
                     print(f"   - 检测到结尾逗号问题")
-                if content.count('{') != content.count('}'):
+                if issues & UNBALANCED_BRACES:
                     print(f"   - 检测到括号不匹配问题")
                     
         else:
@@ -245,19 +296,18 @@ def main():
     print(f"🌐 测试服务器: {base_url}")
     print(f"🎯 测试目标: 验证 JSON 清理功能")
     
-    # 检查连接
-    try:
-        requests.get(base_url, timeout=5)
+    with create_session(api_key) as session:
+        # 检查连接
+        if not check_server(session, base_url):
+            print(f"❌ 无法连接到服务器")
+            return
         print(f"✅ 服务器连接正常")
-    except:
-        print(f"❌ 无法连接到服务器")
-        return
-    
-    # 运行 JSON 清理测试
-    test_json_cleaning(api_key, base_url)
-    
-    # 运行问题案例测试
-    test_problematic_json_cases(api_key, base_url)
+        
+        # 运行 JSON 清理测试
+        test_json_cleaning(session, base_url)
+        
+        # 运行问题案例测试
+        test_problematic_json_cases(session, base_url)
     
     print(f"\n📋 JSON 清理功能说明:")
     print(f"🧹 自动移除多余的引号包围")
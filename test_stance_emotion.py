@@ -6,26 +6,15 @@
 
 import requests
 import sys
+from typing import Final
+from _test_utils import check_server, create_session, dumps_json, json_intent, loads_json, parse_chat_response, post_all, read_error_text, report_cases
 
-def test_stance_emotion_analysis(api_key: str, base_url: str):
-    """测试立场情绪分析场景"""
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-    print("🎭 立场情绪分析测试")
-    print("验证不会误判为 JSON 请求")
-    print("=" * 60)
-    
-    # 用户的实际请求
-    test_payload = {
-        "model": "gemini-2.5-flash-preview-05-20",
-        "messages": [
-            {
-                "role": "user",
-                "content": """
+# 合法的立场和情绪标签
+VALID_STANCES = frozenset(('支持', '反对', '中立'))
+VALID_EMOTIONS = frozenset(('开心', '愤怒', '悲伤', '惊讶', '平静', '害羞', '恐惧', '厌恶', '困惑'))
+
+# 用户的实际请求
+_STANCE_PROMPT: Final[str] = """
 请严格根据以下对话内容，完成以下任务：
 1. 判断回复者对被回复者观点的直接立场：
 - "支持"：明确同意或强化被回复者观点
@@ -48,38 +37,53 @@ def test_stance_emotion_analysis(api_key: str, base_url: str):
 - 只需输出"立场-情绪"结果，不要解释
 - 严格基于文字直接表达的对立关系判断
                 """
-            }
-        ],
-        "temperature": 0.7,
-        "max_tokens": 3000
-    }
+
+_STANCE_PAYLOAD: Final[dict] = {
+    "model": "gemini-2.5-flash-preview-05-20",
+    "messages": [
+        {
+            "role": "user",
+            "content": _STANCE_PROMPT
+        }
+    ],
+    "temperature": 0.7,
+    "max_tokens": 3000
+}
+
+# 请求体只序列化一次
+_STANCE_BODY: Final[bytes] = dumps_json(_STANCE_PAYLOAD)
+
+def test_stance_emotion_analysis(session: requests.Session, base_url: str):
+    """测试立场情绪分析场景"""
+    
+    print("🎭 立场情绪分析测试")
+    print("验证不会误判为 JSON 请求")
+    print("=" * 60)
     
     print(f"📤 发送立场情绪分析请求...")
     
     try:
-        response = requests.post(
+        response = session.post(
             f"{base_url}/v1/chat/completions",
-            headers=headers,
-            json=test_payload,
-            timeout=30
+            data=_STANCE_BODY,
+            timeout=30,
+            stream=True
         )
         
         print(f"📡 响应状态: {response.status_code}")
         
         if response.status_code == 200:
-            data = response.json()
-            content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-            usage = data.get('usage', {})
-            
-            completion_tokens = usage.get('completion_tokens', 0)
-            user_max_tokens = 3000
+            result = parse_chat_response(response.content)
+            content = result.content
+            completion_tokens = result.completion_tokens
+            user_max_tokens = _STANCE_PAYLOAD["max_tokens"]
             
             print(f"📊 用户设置: {user_max_tokens} tokens")
             print(f"📊 实际输出: {completion_tokens} tokens")
             print(f"📝 AI 回复: \"{content}\"")
             
-            # 检查是否被误判为 JSON 请求
-            was_treated_as_json = completion_tokens > 10000  # 如果超过 10k，说明被当作 JSON 处理
+            # 检查是否被误判为 JSON 请求（响应头缺失时：如果超过 10k，说明被当作 JSON 处理）
+            was_treated_as_json = json_intent(response, completion_tokens > 10000)
             
             if was_treated_as_json:
                 print(f"❌ 被误判为 JSON 请求（使用了无限制 token）")
@@ -89,20 +93,19 @@ def test_stance_emotion_analysis(api_key: str, base_url: str):
             # 检查回复格式是否正确
             content_stripped = content.strip().strip('"')
             
-            if content_stripped.count('-') == 1 and len(content_stripped.split('-')) == 2:
-                stance, emotion = content_stripped.split('-')
+            stance, sep, emotion = content_stripped.partition('-')
+            
+            if sep and '-' not in emotion:
                 print(f"✅ 回复格式正确: 立场='{stance}', 情绪='{emotion}'")
                 
                 # 检查立场是否合理
-                valid_stances = ['支持', '反对', '中立']
-                if stance in valid_stances:
+                if stance in VALID_STANCES:
                     print(f"✅ 立场分析合理")
                 else:
                     print(f"⚠️ 立场分析可能有问题: '{stance}'")
                     
                 # 检查情绪是否合理
-                valid_emotions = ['开心', '愤怒', '悲伤', '惊讶', '平静', '害羞', '恐惧', '厌恶', '困惑']
-                if emotion in valid_emotions:
+                if emotion in VALID_EMOTIONS:
                     print(f"✅ 情绪分析合理")
                 else:
                     print(f"⚠️ 情绪分析可能有问题: '{emotion}'")
@@ -110,8 +113,7 @@ def test_stance_emotion_analysis(api_key: str, base_url: str):
             elif content.startswith('{') and content.endswith('}'):
                 print(f"❌ 错误返回了 JSON 格式，应该返回 '立场-情绪' 格式")
                 try:
-                    import json
-                    parsed = json.loads(content)
+                    parsed = loads_json(content)
                     if '立场' in parsed and '情绪' in parsed:
                         correct_format = f"{parsed['立场']}-{parsed['情绪']}"
                         print(f"💡 正确格式应该是: \"{correct_format}\"")
@@ -122,81 +124,78 @@ def test_stance_emotion_analysis(api_key: str, base_url: str):
             
         else:
             print(f"❌ 请求失败: {response.status_code}")
+            error_text = read_error_text(response)
             try:
-                error_data = response.json()
+                error_data = loads_json(error_text)
                 print(f"   错误信息: {error_data}")
             except:
-                print(f"   错误文本: {response.text[:200]}")
+                print(f"   错误文本: {error_text[:200]}")
                 
     except Exception as e:
         print(f"❌ 请求异常: {e}")
 
-def test_simple_cases(api_key: str, base_url: str):
-    """测试简单的对比案例"""
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
+_SIMPLE_CASES = (
+    {
+        "name": "明确的 JSON 请求",
+        "content": "请用JSON格式返回用户信息，包含姓名和年龄",
+        "expect_json": True
+    },
+    {
+        "name": "立场情绪分析（不是 JSON）",
+        "content": "请分析立场和情绪，按照 '立场-情绪' 格式输出",
+        "expect_json": False
+    },
+    {
+        "name": "包含 JSON 字符的普通请求",
+        "content": "请分析这段代码：{name: 'test'} 是否正确",
+        "expect_json": False
     }
+)
+
+def test_simple_cases(session: requests.Session, base_url: str):
+    """测试简单的对比案例"""
     
     print(f"\n🔄 对比测试")
     print("=" * 40)
     
-    test_cases = [
+    payloads = [
         {
-            "name": "明确的 JSON 请求",
-            "content": "请用JSON格式返回用户信息，包含姓名和年龄",
-            "expect_json": True
-        },
-        {
-            "name": "立场情绪分析（不是 JSON）",
-            "content": "请分析立场和情绪，按照 '立场-情绪' 格式输出",
-            "expect_json": False
-        },
-        {
-            "name": "包含 JSON 字符的普通请求",
-            "content": "请分析这段代码：{name: 'test'} 是否正确",
-            "expect_json": False
-        }
-    ]
-    
-    for i, test_case in enumerate(test_cases, 1):
-        print(f"\n📋 测试 {i}: {test_case['name']}")
-        
-        payload = {
             "model": "gemini-1.5-flash",
             "messages": [{"role": "user", "content": test_case["content"]}],
             "max_tokens": 100
         }
+        for test_case in _SIMPLE_CASES
+    ]
+    
+    responses = post_all(session, base_url, payloads)
+    
+    for i, test_case, response, buf in report_cases(_SIMPLE_CASES, responses):
+        print(f"\n📋 测试 {i}: {test_case['name']}", file=buf)
         
         try:
-            response = requests.post(
-                f"{base_url}/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            if isinstance(response, Exception):
+                raise response
             
             if response.status_code == 200:
-                data = response.json()
-                completion_tokens = data.get('usage', {}).get('completion_tokens', 0)
+                completion_tokens = parse_chat_response(response.content).completion_tokens
                 
-                # 简单判断是否被当作 JSON 处理
-                was_treated_as_json = completion_tokens > 500  # 如果超过 500，可能被当作 JSON
+                # 判断是否被当作 JSON 处理（响应头缺失时：如果超过 500，可能被当作 JSON）
+                was_treated_as_json = json_intent(response, completion_tokens > 500)
                 expect_json = test_case["expect_json"]
                 
                 if expect_json == was_treated_as_json:
-                    print(f"   ✅ 检测正确")
+                    print(f"   ✅ 检测正确", file=buf)
                 else:
-                    print(f"   ❌ 检测错误 (期望: {expect_json}, 实际: {was_treated_as_json})")
+                    print(f"   ❌ 检测错误 (期望: {expect_json}, 实际: {was_treated_as_json})", file=buf)
                     
-                print(f"   📊 输出 tokens: {completion_tokens}")
+                print(f"   📊 输出 tokens: {completion_tokens}", file=buf)
                 
             else:
-                print(f"   ❌ 请求失败: {response.status_code}")
+                print(f"   ❌ 请求失败: {response.status_code}", file=buf)
+                response.close()
                 
         except Exception as e:
-            print(f"   ❌ 异常: {e}")
+            print(f"   ❌ 异常: {e}", file=buf)
 
 def main():
     if len(sys.argv) < 2:
@@ -210,19 +209,18 @@ def main():
     print(f"🌐 测试服务器: {base_url}")
     print(f"🎯 测试目标: 验证立场情绪分析不被误判为 JSON")
     
-    # 检查连接
-    try:
-        requests.get(base_url, timeout=5)
+    with create_session(api_key) as session:
+        # 检查连接
+        if not check_server(session, base_url):
+            print(f"❌ 无法连接到服务器")
+            return
         print(f"✅ 服务器连接正常")
-    except:
-        print(f"❌ 无法连接到服务器")
-        return
-    
-    # 运行立场情绪分析测试
-    test_stance_emotion_analysis(api_key, base_url)
-    
-    # 运行对比测试
-    test_simple_cases(api_key, base_url)
+        
+        # 运行立场情绪分析测试
+        test_stance_emotion_analysis(session, base_url)
+        
+        # 运行对比测试
+        test_simple_cases(session, base_url)
     
     print(f"\n📋 修复说明:")
     print(f"🎯 只检测明确要求 JSON 格式的请求")
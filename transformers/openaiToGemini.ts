@@ -57,7 +57,8 @@ function extractGifFrames(dataUri: string): GeminiPart[] {
 
 export function transformOpenAIRequestToGemini(
   openaiRequest: OpenAIRequest,
-  _geminiModelId: string
+  _geminiModelId: string,
+  isJsonRequest = detectJsonRequest(openaiRequest)
 ): GeminiRequest {
   const contents: GeminiContent[] = [];
   let userSystemContent = "";
@@ -192,10 +193,6 @@ export function transformOpenAIRequestToGemini(
   // 创建自然输出提示词（仅在非JSON格式时应用）
   let finalSystemContent = userSystemContent;
 
-  // 智能检测JSON请求
-  const isJsonRequest = openaiRequest.response_format?.type === "json_object" ||
-                       isJsonContentRequest(openaiRequest.messages);
-
   if (!isJsonRequest) {
     const naturalOutputPrompt = `请用自然、连贯的语言回复，严格禁止使用以下格式：
 - 禁止使用星号 * 和 ** 进行任何格式化
@@ -472,119 +469,74 @@ function convertDataUriToInlineData(dataUri: string): GeminiPart | null {
   }
 }
 
+// 明确要求 JSON 格式的关键词（忽略大小写，合并为单个正则一次扫描）
+const JSON_FORMAT_KEYWORD_PATTERN = new RegExp([
+  'json格式', 'json对象',
+  '返回json', '输出json',
+  '请用json', '用json',
+  'json格式回答', 'json格式输出',
+  'json回复', 'json响应',
+  'json结果', 'json数据',
+  'json形式', 'json方式'
+].join('|'), 'i');
+
+// JSON 请求的常见模式
+const JSON_REQUEST_PATTERN = new RegExp([
+  '请.*用.*json.*格式',
+  '请.*返回.*json',
+  '输出.*json.*格式',
+  'json.*格式.*返回',
+  '以.*json.*格式',
+  '转换.*json',
+  '生成.*json',
+  '创建.*json',
+  '提供.*json',
+  '给出.*json',
+  'json.*示例',
+  'json.*模板',
+  'json.*结构'
+].join('|'), 'i');
+
+// JSON 示例模式（更精确的检测），如 示例：{"key": "value"}
+const JSON_EXAMPLE_PATTERN = /(?:示例|例如|格式|如下|类似).*\{.*".*".*:.*".*".*\}/;
+
+// 特定字段的 JSON 请求
+const JSON_FIELD_PATTERN = /"(?:name|nickname|reason|description|title|content|response|result)".*:.*".*"/i;
+
+// 分析类请求关键词，用于排除分析别人 JSON 的场景
+const ANALYSIS_KEYWORD_PATTERN = /分析|解析|理解|说明|解释/;
+
+// 检测单段文本是否在要求 JSON 输出
+function isJsonContentText(content: string): boolean {
+  if (
+    JSON_FORMAT_KEYWORD_PATTERN.test(content) ||
+    JSON_REQUEST_PATTERN.test(content) ||
+    JSON_EXAMPLE_PATTERN.test(content)
+  ) {
+    return true;
+  }
+
+  // 检查特定字段的 JSON 模式（但要排除纯分析场景）
+  return JSON_FIELD_PATTERN.test(content) && !ANALYSIS_KEYWORD_PATTERN.test(content);
+}
+
+// 判断请求是否按 JSON 请求处理（显式 response_format 或智能检测）
+export function detectJsonRequest(openaiRequest: OpenAIRequest): boolean {
+  return openaiRequest.response_format?.type === "json_object" ||
+    isJsonContentRequest(openaiRequest.messages);
+}
+
 // JSON 内容检测函数
 function isJsonContentRequest(messages: OpenAIMessage[]): boolean {
-  // 明确要求 JSON 格式的关键词
-  const jsonFormatKeywords = [
-    'json格式', 'json对象', 'JSON格式', 'JSON对象',
-    '返回json', '输出json', '返回JSON', '输出JSON',
-    '请用json', '请用JSON', '用json', '用JSON',
-    'json格式回答', 'JSON格式回答',
-    'json格式输出', 'JSON格式输出',
-    'json回复', 'JSON回复',
-    'json响应', 'JSON响应',
-    'json结果', 'JSON结果',
-    'json数据', 'JSON数据',
-    'json形式', 'JSON形式',
-    'json方式', 'JSON方式'
-  ];
-
-  // JSON 请求的常见模式
-  const jsonRequestPatterns = [
-    /请.*用.*json.*格式/i,
-    /请.*返回.*json/i,
-    /输出.*json.*格式/i,
-    /json.*格式.*返回/i,
-    /以.*json.*格式/i,
-    /转换.*json/i,
-    /生成.*json/i,
-    /创建.*json/i,
-    /提供.*json/i,
-    /给出.*json/i,
-    /json.*示例/i,
-    /json.*模板/i,
-    /json.*结构/i
-  ];
-
-  // JSON 示例模式（更精确的检测）
-  const jsonExamplePatterns = [
-    /示例.*\{.*".*".*:.*".*".*\}/,  // 示例：{"key": "value"}
-    /例如.*\{.*".*".*:.*".*".*\}/,  // 例如：{"key": "value"}
-    /格式.*\{.*".*".*:.*".*".*\}/,  // 格式：{"key": "value"}
-    /如下.*\{.*".*".*:.*".*".*\}/,  // 如下：{"key": "value"}
-    /类似.*\{.*".*".*:.*".*".*\}/   // 类似：{"key": "value"}
-  ];
-
-  // 特定字段的 JSON 请求
-  const jsonFieldPatterns = [
-    /"name".*:.*".*"/i,
-    /"nickname".*:.*".*"/i,
-    /"reason".*:.*".*"/i,
-    /"description".*:.*".*"/i,
-    /"title".*:.*".*"/i,
-    /"content".*:.*".*"/i,
-    /"response".*:.*".*"/i,
-    /"result".*:.*".*"/i
-  ];
-
   for (const message of messages) {
     if (typeof message.content === 'string') {
-      const content = message.content;
-
-      // 检查明确的 JSON 关键词
-      if (jsonFormatKeywords.some(keyword => content.toLowerCase().includes(keyword.toLowerCase()))) {
-        return true;
-      }
-
-      // 检查 JSON 请求模式
-      if (jsonRequestPatterns.some(pattern => pattern.test(content))) {
+      if (isJsonContentText(message.content)) {
         return true;
       }
-
-      // 检查 JSON 示例模式
-      if (jsonExamplePatterns.some(pattern => pattern.test(content))) {
-        return true;
-      }
-
-      // 检查特定字段的 JSON 模式（但要排除纯分析场景）
-      if (jsonFieldPatterns.some(pattern => pattern.test(content))) {
-        // 额外检查：确保不是在分析别人的 JSON，而是要求生成 JSON
-        const analysisKeywords = ['分析', '解析', '理解', '说明', '解释'];
-        const isAnalysis = analysisKeywords.some(keyword => content.includes(keyword));
-
-        if (!isAnalysis) {
-          return true;
-        }
-      }
     } else if (Array.isArray(message.content)) {
       for (const part of message.content) {
-        if (part.type === 'text' && part.text) {
-          const content = part.text;
-
-          // 检查明确的 JSON 关键词
-          if (jsonFormatKeywords.some(keyword => content.toLowerCase().includes(keyword.toLowerCase()))) {
-            return true;
-          }
-
-          // 检查 JSON 请求模式
-          if (jsonRequestPatterns.some(pattern => pattern.test(content))) {
-            return true;
-          }
-
-          // 检查 JSON 示例模式
-          if (jsonExamplePatterns.some(pattern => pattern.test(content))) {
-            return true;
-          }
-
-          // 检查特定字段的 JSON 模式
-          if (jsonFieldPatterns.some(pattern => pattern.test(content))) {
-            const analysisKeywords = ['分析', '解析', '理解', '说明', '解释'];
-            const isAnalysis = analysisKeywords.some(keyword => content.includes(keyword));
-
-            if (!isAnalysis) {
-              return true;
-            }
-          }
+        if (part.type === 'text' && part.text && isJsonContentText(part.text)) {
+          return true;
         }
       }
     }